@@ -139,6 +139,8 @@ pub async fn load_data_to_memory(
 
     let uuid_list: Vec<String> = hitokotos.iter().map(|h| h.uuid.clone()).collect(); // 创建UUID列表
 
+    // 所有行在同一个连接的事务中插入，避免每行都从连接池获取连接
+    let mut tx = memory_pool.begin().await?;
     for hitokoto in hitokotos {
         sqlx::query(
             r#"
@@ -153,9 +155,10 @@ pub async fn load_data_to_memory(
         .bind(hitokoto.from_source)
         .bind(hitokoto.from_who)
         .bind(hitokoto.length)
-        .execute(&memory_pool)
+        .execute(&mut *tx)
         .await?;
     }
+    tx.commit().await?;
 
     // 创建UUID索引
     sqlx::query("CREATE INDEX idx_uuid ON hitokoto (uuid)")
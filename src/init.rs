@@ -1,14 +1,35 @@
 use crate::db::table_exists;
-use actix_web::Error;
-use serde::{Deserialize, Serialize};
+use actix_web::{Error, rt};
+use reqwest::{StatusCode, header};
+use serde::{Deserialize, Deserializer, Serialize};
 use sqlx::migrate::MigrateDatabase;
-use sqlx::{AnyPool, any::Any, any::AnyPoolOptions};
+use sqlx::{
+    AnyPool,
+    any::{Any, AnyConnectOptions, AnyConnection, AnyPoolOptions},
+    sqlite::SqliteSynchronous,
+};
+use std::borrow::Cow;
+use std::collections::HashSet;
+use std::path::{Path, PathBuf};
+use std::str::FromStr;
+use std::sync::LazyLock;
 use std::{fs, io::Write};
 
 // TODO: 改成可以变的
 const VERSION_URL: &str =
     "https://github.com/hitokoto-osc/sentences-bundle/raw/refs/heads/master/version.json";
 const CACHE_DIR: &str = "./cache";
+// 每条 INSERT 语句包含的行数，6 列时参数个数远低于 SQLite/MySQL 的上限
+const INSERT_CHUNK_SIZE: usize = 500;
+static FULL_CHUNK_INSERT_SQL: LazyLock<String> = LazyLock::new(|| insert_sql(INSERT_CHUNK_SIZE));
+// SQLite 数据库页大小，只能在连接选项中设置，sqlx 会在切换 WAL 之前执行
+const SQLITE_PAGE_SIZE: u32 = 8192;
+// SQLite 批量导入时使用的其他参数，sqlx 默认已启用 WAL
+const SQLITE_PRAGMAS: &[(&str, &str)] = &[
+    ("mmap_size", "268435456"),
+    ("cache_size", "-131072"),
+    ("temp_store", "MEMORY"),
+];
 
 #[derive(Debug, Serialize, Deserialize)]
 struct VersionData {
@@ -23,45 +44,92 @@ struct CategoryMeta {
     timestamp: u64,
 }
 
-#[derive(Debug, Serialize, Deserialize, Clone)]
-struct Sentence {
-    uuid: String,
-    hitokoto: String,
-    #[serde(rename = "type")]
-    sentence_type: String,
-    from: String,
-    from_who: Option<String>,
+// 字段直接借用下载内容，避免为每行复制字符串
+#[derive(Debug, Deserialize)]
+struct Sentence<'a> {
+    #[serde(borrow)]
+    uuid: Cow<'a, str>,
+    #[serde(borrow)]
+    hitokoto: Cow<'a, str>,
+    #[serde(rename = "type", borrow)]
+    sentence_type: Cow<'a, str>,
+    #[serde(borrow)]
+    from: Cow<'a, str>,
+    #[serde(default, deserialize_with = "borrow_optional_str")]
+    from_who: Option<Cow<'a, str>>,
     length: i32,
 }
 
+/// serde 不会对 `Option<Cow<str>>` 自动借用，这里手动借用以免为每行分配 `from_who`
+fn borrow_optional_str<'de: 'a, 'a, D>(deserializer: D) -> Result<Option<Cow<'a, str>>, D::Error>
+where
+    D: Deserializer<'de>,
+{
+    #[derive(Deserialize)]
+    struct Borrowed<'a>(#[serde(borrow)] Cow<'a, str>);
+
+    Ok(Option::<Borrowed>::deserialize(deserializer)?.map(|borrowed| borrowed.0))
+}
+
+// 缓存元数据：分类时间戳以及用于条件请求的 ETag / Last-Modified
 #[derive(Debug, Serialize, Deserialize)]
-struct CategoryData {
+struct CacheMeta {
     timestamp: u64,
-    sentences: Vec<Sentence>,
+    etag: Option<String>,
+    last_modified: Option<String>,
 }
 
 pub async fn init_db(db_url: &str) -> Result<(), Error> {
     let pool = get_pool(db_url).await.unwrap();
 
-    // 创建缓存目录
+    // 创建缓存目录，之后的缓存路径直接拼接，不再逐个检查目录
     fs::create_dir_all(CACHE_DIR)?;
 
-    let version_data = get_version().await.unwrap();
+    // 所有请求共用同一个客户端以复用连接
+    let client = reqwest::Client::new();
 
-    let mut total_inserted = 0;
+    let version_data = get_version(&client).await.unwrap();
 
-    for category in version_data.sentences {
-        println!("\nProcessing category: {}", category.name);
+    let mut total_inserted = 0;
 
-        let sentences =
-            fetch_category_data(&category.key, &category.name, category.timestamp).await?;
+    // 所有分类的下载都交给事件循环并发执行，插入时下载仍在后台进行
+    let downloads: Vec<_> = version_data
+        .sentences
+        .into_iter()
+        .map(|category| {
+            let client = client.clone();
+            rt::spawn(async move {
+                let cache_path =
+                    fetch_category_data(&client, &category.key, &category.name, category.timestamp)
+                        .await;
+                (category, cache_path)
+            })
+        })
+        .collect();
+
+    // 所有分类在同一个事务中插入
+    let mut tx = pool.begin().await.unwrap();
+    let mut seen_uuids = HashSet::new();
+
+    // 按分类顺序依次插入
+    for download in downloads {
+        let (category, cache_path) = download.await.unwrap();
+        // 下载任务只把数据写到磁盘，插入前才读入内存，内存中同时只保留一个分类
+        let content = fs::read(cache_path?)?;
+        let mut sentences: Vec<Sentence> = serde_json::from_slice(&content)?;
+        // 在客户端去重，保证导入后可以建立 uuid 唯一索引
+        sentences.retain(|sentence| seen_uuids.insert(sentence.uuid.to_string()));
 
         // 批量插入
-        let inserted = batch_insert_sentences(&pool, &sentences).await.unwrap();
+        let inserted = batch_insert_sentences(&mut tx, &sentences).await.unwrap();
+        // 每个分类只输出一行，避免与后台下载任务的输出交错
+        println!("{}: 成功插入 {} 条记录", category.name, inserted);
 
         total_inserted += inserted;
     }
 
+    tx.commit().await.unwrap();
+
     // 创建索引
     create_indexes(&pool).await.unwrap();
     pool.close().await;
@@ -74,20 +142,22 @@ pub async fn init_db(db_url: &str) -> Result<(), Error> {
 }
 
 async fn fetch_category_data(
+    client: &reqwest::Client,
     key: &String,
     name: &String,
     timestamp: u64,
-) -> Result<Vec<Sentence>, Error> {
-    let cache_path = std::path::Path::new(CACHE_DIR).join(format!("{}.json", key));
+) -> Result<PathBuf, Error> {
+    let cache_path = PathBuf::from(format!("{CACHE_DIR}/{key}.json"));
+    let meta_path = PathBuf::from(format!("{CACHE_DIR}/{key}.meta.json"));
 
-    // 先尝试从缓存加载
-    if let Ok(cached_content) = fs::read_to_string(&cache_path) {
-        let cached_data: CategoryData = serde_json::from_str(&cached_content)?;
+    // 先尝试从缓存加载，缓存文件即原始下载内容，时间戳单独保存
+    let cached_meta = read_cache_meta(&cache_path, &meta_path);
 
-        // 检查缓存是否需要更新
-        if timestamp <= cached_data.timestamp {
+    // 检查缓存是否需要更新
+    if let Some(meta) = &cached_meta {
+        if timestamp <= meta.timestamp {
             println!("缓存的 {} 数据是最新的，无需更新", name);
-            return Ok(cached_data.sentences);
+            return Ok(cache_path);
         }
     }
 
@@ -95,91 +165,194 @@ async fn fetch_category_data(
         "https://github.com/hitokoto-osc/sentences-bundle/raw/refs/heads/master/sentences/{}.json",
         key
     );
-    let client = reqwest::Client::new();
-    let response = client.get(&url).send().await.unwrap();
+    if download_to_cache(
+        client,
+        &url,
+        &cache_path,
+        &meta_path,
+        cached_meta,
+        timestamp,
+    )
+    .await?
+    {
+        println!("成功下载 {} 数据", name);
+    } else {
+        println!("{} 数据未变化，使用缓存", name);
+    }
+
+    Ok(cache_path)
+}
+
+/// 读取缓存元数据，缓存文件或元数据不存在时返回 `None`
+fn read_cache_meta(cache_path: &Path, meta_path: &Path) -> Option<CacheMeta> {
+    if !cache_path.exists() {
+        return None;
+    }
+    let meta = fs::read(meta_path).ok()?;
+    serde_json::from_slice(&meta).ok()
+}
+
+/// 下载到缓存文件并更新元数据
+///
+/// 已有缓存时带上 `If-None-Match` / `If-Modified-Since` 发起条件请求，
+/// 返回 `false` 表示服务器返回 304，缓存文件保持不变。
+/// 响应内容分块写入临时文件再重命名，避免留下不完整的缓存。
+async fn download_to_cache(
+    client: &reqwest::Client,
+    url: &str,
+    cache_path: &Path,
+    meta_path: &Path,
+    cached_meta: Option<CacheMeta>,
+    timestamp: u64,
+) -> Result<bool, Error> {
+    let mut request = client.get(url);
+    if let Some(meta) = &cached_meta {
+        if let Some(etag) = &meta.etag {
+            request = request.header(header::IF_NONE_MATCH, etag.as_str());
+        }
+        if let Some(last_modified) = &meta.last_modified {
+            request = request.header(header::IF_MODIFIED_SINCE, last_modified.as_str());
+        }
+    }
 
-    let sentences: Vec<Sentence> = response.json().await.unwrap();
-    println!("成功下载 {} 数据", name);
+    let response = request.send().await.unwrap();
 
-    // 保存到缓存
-    let cache_data = CategoryData {
+    if let (StatusCode::NOT_MODIFIED, Some(meta)) = (response.status(), cached_meta) {
+        let meta = serde_json::to_vec(&CacheMeta { timestamp, ..meta })?;
+        fs::write(meta_path, meta)?;
+        return Ok(false);
+    }
+
+    let mut response = response.error_for_status().unwrap();
+    let header_value = |name: header::HeaderName| {
+        response
+            .headers()
+            .get(name)
+            .and_then(|value| value.to_str().ok())
+            .map(str::to_string)
+    };
+    let meta = CacheMeta {
         timestamp,
-        sentences: sentences.clone(),
+        etag: header_value(header::ETAG),
+        last_modified: header_value(header::LAST_MODIFIED),
     };
 
-    let mut file = std::fs::File::create(&cache_path).unwrap();
-    let json = serde_json::to_string_pretty(&cache_data)?;
-    file.write_all(json.as_bytes()).unwrap();
+    let tmp_path = cache_path.with_extension("json.tmp");
+    let mut file = fs::File::create(&tmp_path)?;
+    while let Some(chunk) = response.chunk().await.unwrap() {
+        file.write_all(&chunk)?;
+    }
+    fs::rename(&tmp_path, cache_path)?;
+
+    // 下载完整后再写入元数据，避免缓存不完整的数据
+    fs::write(meta_path, serde_json::to_vec(&meta)?)?;
 
-    Ok(sentences)
+    Ok(true)
 }
 
 async fn batch_insert_sentences(
-    pool: &AnyPool,
-    sentences: &[Sentence],
+    conn: &mut AnyConnection,
+    sentences: &[Sentence<'_>],
 ) -> Result<usize, sqlx::Error> {
-    let mut tx = pool.begin().await?;
-
-    for sentence in sentences {
-        sqlx::query(
-            r#"
-            INSERT INTO hitokoto (uuid, text, type, from_source, from_who, length)
-            VALUES (?, ?, ?, ?, ?, ?)
-            "#,
-        )
-        .bind(&sentence.uuid)
-        .bind(&sentence.hitokoto)
-        .bind(&sentence.sentence_type)
-        .bind(&sentence.from)
-        .bind(&sentence.from_who)
-        .bind(sentence.length)
-        .execute(&mut *tx)
-        .await?;
+    let mut inserted = 0;
+
+    // 每个分块拼成一条多行 INSERT，减少语句执行次数
+    // sqlx 不支持 MySQL 的 LOAD DATA LOCAL INFILE，也没有 sqlite3 命令行的 .import，
+    // 多行 INSERT 是两种数据库都能用的最快导入方式
+    for chunk in sentences.chunks(INSERT_CHUNK_SIZE) {
+        // 完整分块复用同一条 SQL，只有最后不足一块时才重新拼接
+        let tail_sql;
+        let sql: &str = if chunk.len() == INSERT_CHUNK_SIZE {
+            &FULL_CHUNK_INSERT_SQL
+        } else {
+            tail_sql = insert_sql(chunk.len());
+            &tail_sql
+        };
+
+        let mut query = sqlx::query(sql);
+        for sentence in chunk {
+            query = query
+                .bind(&*sentence.uuid)
+                .bind(&*sentence.hitokoto)
+                .bind(&*sentence.sentence_type)
+                .bind(&*sentence.from)
+                .bind(sentence.from_who.as_deref())
+                .bind(sentence.length);
+        }
+        inserted += query.execute(&mut *conn).await?.rows_affected() as usize;
     }
 
-    tx.commit().await?;
-    println!("成功插入 {} 条记录", sentences.len());
+    Ok(inserted)
+}
 
-    Ok(sentences.len())
+/// 生成一次插入 `rows` 行的 INSERT 语句
+fn insert_sql(rows: usize) -> String {
+    format!(
+        "INSERT INTO hitokoto (uuid, text, type, from_source, from_who, length) VALUES {}",
+        vec!["(?, ?, ?, ?, ?, ?)"; rows].join(", ")
+    )
 }
 
 async fn create_indexes(pool: &AnyPool) -> Result<(), sqlx::Error> {
     let mut conn = pool.acquire().await?;
 
+    // uuid 的唯一约束在导入完成后再建立，避免每次插入都维护索引
+    sqlx::query("CREATE UNIQUE INDEX idx_uuid ON hitokoto (uuid)")
+        .execute(&mut *conn)
+        .await?;
+
     // 创建常用查询字段索引
-    sqlx::query("CREATE INDEX IF NOT EXISTS idx_type ON hitokoto (type)")
+    sqlx::query("CREATE INDEX idx_type ON hitokoto (type)")
         .execute(&mut *conn)
         .await?;
 
-    sqlx::query("CREATE INDEX IF NOT EXISTS idx_length ON hitokoto (length)")
+    sqlx::query("CREATE INDEX idx_length ON hitokoto (length)")
         .execute(&mut *conn)
         .await?;
 
     Ok(())
 }
 
-async fn get_version() -> Result<VersionData, reqwest::Error> {
-    let client = reqwest::Client::new();
-    let response = client.get(VERSION_URL).send().await?;
+async fn get_version(client: &reqwest::Client) -> Result<VersionData, Error> {
+    let cache_path = PathBuf::from(format!("{CACHE_DIR}/version.json"));
+    let meta_path = PathBuf::from(format!("{CACHE_DIR}/version.meta.json"));
 
-    let version_data = response.json::<VersionData>().await?;
+    // version.json 每次都需要确认是否更新，依靠条件请求避免重复下载
+    let cached_meta = read_cache_meta(&cache_path, &meta_path);
+    download_to_cache(client, VERSION_URL, &cache_path, &meta_path, cached_meta, 0).await?;
+
+    let version_data = serde_json::from_slice(&fs::read(&cache_path)?)?;
     Ok(version_data)
 }
 
 async fn get_pool(db_url: &str) -> Result<AnyPool, sqlx::Error> {
     // 检查是否是 SQLite 数据库连接
     if db_url.starts_with("sqlite:") {
-        // 检查数据库是否存在，不存在则创建
+        // 删除已有的数据库，由下面的连接重新创建
+        // 不使用 Any::create_database，它的默认连接会先把页大小固定为 4096
         if Any::database_exists(db_url).await? {
             Any::drop_database(db_url).await?;
         }
-        Any::create_database(db_url).await?;
+    }
+
+    // SQLite 参数写在连接选项里，连接池新建的每个连接都会应用
+    let mut connect_options = AnyConnectOptions::from_str(db_url)?;
+    if let Some(sqlite_options) = connect_options.as_sqlite_mut() {
+        let mut options = sqlite_options
+            .clone()
+            .create_if_missing(true)
+            .page_size(SQLITE_PAGE_SIZE)
+            .synchronous(SqliteSynchronous::Normal);
+        for (key, value) in SQLITE_PRAGMAS {
+            options = options.pragma(*key, *value);
+        }
+        *sqlite_options = options;
     }
 
     // 创建数据库连接池
     let pool = AnyPoolOptions::new()
         .max_connections(1)
-        .connect(db_url)
+        .connect_with(connect_options)
         .await?;
 
     if table_exists(&pool, "hitokoto").await? {
@@ -192,7 +365,7 @@ async fn get_pool(db_url: &str) -> Result<AnyPool, sqlx::Error> {
         sqlx::any::AnyKind::Sqlite => r#"
                 CREATE TABLE IF NOT EXISTS hitokoto (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    uuid TEXT UNIQUE NOT NULL,
+                    uuid TEXT NOT NULL,
                     text TEXT NOT NULL,
                     type TEXT NOT NULL,
                     from_source TEXT NOT NULL,
@@ -204,7 +377,7 @@ async fn get_pool(db_url: &str) -> Result<AnyPool, sqlx::Error> {
         sqlx::any::AnyKind::MySql => r#"
                 CREATE TABLE IF NOT EXISTS hitokoto (
                     id INT PRIMARY KEY AUTO_INCREMENT,
-                    uuid VARCHAR(36) UNIQUE NOT NULL,
+                    uuid VARCHAR(36) NOT NULL,
                     text TEXT NOT NULL,
                     type VARCHAR(1) NOT NULL,
                     from_source TEXT NOT NULL,